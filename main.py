@@ -1,5 +1,6 @@
 # main.py
 import argparse
+import logging
 import random
 import socket
 import sys
@@ -31,6 +32,10 @@ def main():
     parser.add_argument('--nogui', action='store_true', help='Консольный режим')
     parser.add_argument('--debug', action='store_true', help='Режим отладки')
     args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.debug else logging.WARNING,
+        format='[%(levelname)s] %(message)s',
+    )
 
     bind_host = '' if args.host == '127.0.0.1' else args.host
     if args.port == 0:
@@ -46,7 +51,8 @@ def main():
             print(f'[DEBUG] {data}')
         elif event == 'file_request':
             peer_id, name, size = data
-            answer = input(f'Пир {peer_id} прислал файл "{name}" ({size} байт). Принять? [y/N]: ')
+            who = network_manager.peer_nicks.get(peer_id) or peer_id.hex()[:8]
+            answer = input(f'Пир {who} прислал файл "{name}" ({size} байт). Принять? [y/N]: ')
             network_manager.respond_file(peer_id, answer.lower().startswith('y'))
         elif args.debug or event not in ('heartbeat',):
             print(f'Event: {event}, Data: {data}')
@@ -65,7 +71,8 @@ def main():
                     if msg == '/exit':
                         network_manager.stop()
                         break
-                    network_manager.send_text(msg)
+                    if not network_manager.send_text(msg):
+                        print('Сообщение слишком длинное')
 
             threading.Thread(target=console_input, daemon=True).start()
             while network_manager.running:
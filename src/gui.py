@@ -1,14 +1,28 @@
 # src/gui.py
 import os
+import threading
 import tkinter as tk
+from collections import deque
 from tkinter import ttk, scrolledtext, filedialog, messagebox
 
+from src.network import MAX_NICK
+
 class ChatGUI:
     '''Графический интерфейс для P2P-чата.'''
+    FLUSH_INTERVAL = 50
+    FLUSH_BATCH = 500
+    MAX_LINES = 5000
+
     def __init__(self, network_manager, port):
         '''Инициализирует GUI.'''
         self.network = network_manager
         self.port = port
+        self._pending_messages = deque()
+        self._flush_scheduled = False
+        self._peer_items = {}
+        self._pending_peers = None
+        self._peers_scheduled = False
+        self._peers_lock = threading.Lock()
         self.root = tk.Tk()
         self.root.title(f'Децентрализованный чат (Порт: {port})')
         self.root.geometry('800x600')
@@ -73,8 +87,10 @@ class ChatGUI:
     def change_nick(self):
         new_nick = self.nick_entry.get()
         if new_nick:
-            self.network.change_nickname(new_nick)
-            self.add_message(f'Ваш ник изменен на: {new_nick}')
+            if self.network.change_nickname(new_nick):
+                self.add_message(f'Ваш ник изменен на: {new_nick}')
+            else:
+                messagebox.showerror('Ошибка', f'Ник длиннее {MAX_NICK} байт')
 
     def connect_to_peer(self):
         host = self.host_entry.get()
@@ -96,37 +112,76 @@ class ChatGUI:
     def send_text(self):
         text = self.message_entry.get()
         if text:
-            self.network.send_text(text)
-            self.add_message(f'Вы: {text}')
+            if self.network.send_text(text):
+                self.add_message(f'Вы: {text}')
+            else:
+                messagebox.showerror('Ошибка', 'Сообщение слишком длинное')
             self.message_entry.delete(0, tk.END)
 
     def add_message(self, message):
-        self.root.after(0, self._add_message_threadsafe, message)
+        '''Ставит сообщение в очередь; вывод пачками раз в FLUSH_INTERVAL мс.'''
+        self._pending_messages.append(message)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            self.root.after(self.FLUSH_INTERVAL, self._flush_messages)
+
+    def _flush_messages(self):
+        '''Вызывается в GUI-потоке: одна вставка и одна прокрутка на всю пачку.'''
+        batch = []
+        while self._pending_messages and len(batch) < self.FLUSH_BATCH:
+            batch.append(self._pending_messages.popleft())
+        if batch:
+            self.chat_area.config(state=tk.NORMAL)
+            self.chat_area.insert(tk.END, '\n'.join(batch) + '\n')
+            lines = int(self.chat_area.index('end-1c').split('.')[0]) - 1
+            if lines > self.MAX_LINES:
+                self.chat_area.delete('1.0', f'{lines - self.MAX_LINES + 1}.0')
+            self.chat_area.config(state=tk.DISABLED)
+            self.chat_area.yview(tk.END)
 
-    def _add_message_threadsafe(self, message):
+        if not self._pending_messages:
+            self._flush_scheduled = False
+            # add_message мог успеть добавить сообщение, увидев ещё поднятый флаг: перепроверяем после сброса.
+            if not self._pending_messages:
+                return
+            self._flush_scheduled = True
+        self.root.after(self.FLUSH_INTERVAL, self._flush_messages)
+
+    def _clear_chat_area(self):
         self.chat_area.config(state=tk.NORMAL)
-        self.chat_area.insert(tk.END, message + '\n')
+        self.chat_area.delete('1.0', tk.END)
         self.chat_area.config(state=tk.DISABLED)
-        self.chat_area.yview(tk.END)
 
     def update_peers_list(self, peers):
-        '''Запускается из потока NetworkManager: обновляет список участников.'''
-        self.root.after(0, self._update_peers_list_threadsafe, peers)
+        '''Запускается из потока NetworkManager: запоминает последний список и планирует одно обновление.'''
+        with self._peers_lock:
+            self._pending_peers = peers
+            schedule = not self._peers_scheduled
+            self._peers_scheduled = True
+        if schedule:
+            self.root.after(self.FLUSH_INTERVAL, self._apply_pending_peers)
+
+    def _apply_pending_peers(self):
+        '''Вызывается в GUI-потоке: применяет только самый свежий список из накопившихся.'''
+        with self._peers_lock:
+            self._peers_scheduled = False
+            peers, self._pending_peers = self._pending_peers, None
+        if peers is not None:
+            self._update_peers_list_threadsafe(peers)
 
     def _update_peers_list_threadsafe(self, peers):
-        '''Вызывается в GUI-потоке: реальное обновление Treeview.'''
-        current = {self.peers_tree.item(i)['text']: i for i in self.peers_tree.get_children()}
-        for p in peers:
-            addr, nick = p['address'], p['nick']
-            if addr in current:
-                item = current.pop(addr)
-                self.peers_tree.item(item, values=(nick,))
-            else:
-                self.peers_tree.insert('', tk.END, text=addr, values=(nick,))
-        # 2) Удаляем тех, кого уже нет
-        for addr, item in current.items():
-            self.peers_tree.delete(item)
-
+        '''Вызывается в GUI-потоке: точечное обновление Treeview; адрес служит iid строки.'''
+        incoming = {p['address']: p['nick'] for p in peers}
+        for addr, nick in incoming.items():
+            known = self._peer_items.get(addr)
+            if known is None:
+                self.peers_tree.insert('', tk.END, iid=addr, text=addr, values=(nick,))
+            elif known != nick:
+                self.peers_tree.item(addr, values=(nick,))
+            self._peer_items[addr] = nick
+        for addr in self._peer_items.keys() - incoming.keys():
+            del self._peer_items[addr]
+            self.peers_tree.delete(addr)
 
     def callback_handler(self, event, data):
         if event == 'message':
@@ -141,9 +196,8 @@ class ChatGUI:
             else:
                 self.network.respond_file(peer_id, False)
         elif event == 'clear_history':
-            self.chat_area.config(state=tk.NORMAL)
-            self.chat_area.delete('1.0', tk.END)
-            self.chat_area.config(state=tk.DISABLED)
+            self._pending_messages.clear()
+            self.root.after(0, self._clear_chat_area)
         elif event == 'debug' and self.network.debug:
             self.add_message(f'[DEBUG] {data}')
 
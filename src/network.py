@@ -1,13 +1,21 @@
 # src/network.py
-import json
+import logging
 import os
-import select
+import selectors
+import shutil
 import socket
+import struct
 import threading
 import time
-import uuid
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
-from src.utils import receive_all, send_all
+from src.utils import (receive_all, send_all, send_all_vec, send_file_range, set_cork, set_send_timeout,
+                       tune_socket)
+
+logger = logging.getLogger(__name__)
+
 
 class MessageType(Enum):
     TEXT = 'TEXT'
@@ -20,468 +28,892 @@ class MessageType(Enum):
     HEARTBEAT = 'BEAT'
     CONNECTION_ID = 'CONN'
     CLEAR_HISTORY = 'CLRH'
+    PEER_ADD = 'PADD'
+    PEER_REMOVE = 'PREM'
+    HISTORY_BULK = 'HIST'
+
+# Заголовок кадра: 4 байта тега типа + 4 байта длины (big-endian)
+_HDR = struct.Struct('>4sI')
+_TAGS = {mt: mt.value.encode() for mt in MessageType}
+_TAG_TYPES = {tag: mt for mt, tag in _TAGS.items()}
+_HEARTBEAT_FRAME = _HDR.pack(_TAGS[MessageType.HEARTBEAT], 0)
+# Предел длины кадра: больше куска файла с запасом; длиннее — разрыв соединения
+MAX_FRAME = 8 << 20
+# Размер буферов ядра для сокетов пиров по умолчанию
+SOCK_BUF = 2 << 20
+# Создание принимаемого файла: атомарно и только если имя свободно
+_CREATE_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+# Двоичные раскладки управляющих кадров (без JSON на горячем пути)
+_PEER_COUNT = struct.Struct('!H')
+_PEER_ENTRY = struct.Struct('!BHH')  # длина host, порт, длина nick; далее байты host и nick
+_FILE_META = struct.Struct('!QH')    # размер файла, длина имени; далее байты имени
+_LINE_LEN = struct.Struct('!I')      # длина строки истории; далее её байты
+_HANDSHAKE = struct.Struct('!BHH')   # длина conn_id, порт прослушивания, длина ника; далее байты
+# Предел длины ника в байтах UTF-8: с запасом влезает в поле 'H' и не раздувает PEER_LIST
+MAX_NICK = 255
+
+
+# Схемы управляющих кадров: поля разбираются один раз, дальше — доступ по атрибутам
+Handshake = namedtuple('Handshake', ['conn_id', 'nickname', 'listen_port'])
+FileMeta = namedtuple('FileMeta', ['name', 'size'])
+
+
+def clip_nick(raw):
+    '''Декодирует ник пира, обрезая его до MAX_NICK байт (без разрыва символа UTF-8).'''
+    nick = str(raw, 'utf-8')
+    if len(raw) > MAX_NICK:
+        nick = nick.encode()[:MAX_NICK].decode('utf-8', 'ignore')
+    return nick
+
+
+def encode_handshake(conn_id, nickname, listen_port):
+    '''Кодирует полезную нагрузку CONNECTION_ID (conn_id — сырые байты) в фиксированную двоичную раскладку.'''
+    nick = nickname.encode()
+    return _HANDSHAKE.pack(len(conn_id), listen_port, len(nick)) + conn_id + nick
+
+
+def parse_handshake(data, default_nick, default_port):
+    '''
+    Разбирает полезную нагрузку CONNECTION_ID; пустые ник и порт заменяются значениями по умолчанию.
+
+    :raises ValueError: если полезная нагрузка обрезана или повреждена
+    '''
+    try:
+        cid_len, listen_port, nick_len = _HANDSHAKE.unpack_from(data)
+    except struct.error as e:
+        raise ValueError(f'некорректный handshake: {e}') from None
+    off = _HANDSHAKE.size
+    if off + cid_len + nick_len > len(data):
+        raise ValueError('некорректный handshake: обрезан')
+    conn_id = bytes(data[off:off + cid_len])
+    off += cid_len
+    nickname = clip_nick(data[off:off + nick_len])
+    return Handshake(conn_id, nickname or default_nick, listen_port or default_port)
+
+
+def parse_file_meta(data):
+    '''Разбирает полезную нагрузку FILE_META: размер, длина имени, имя.'''
+    size, name_len = _FILE_META.unpack_from(data)
+    off = _FILE_META.size
+    return FileMeta(str(data[off:off + name_len], 'utf-8'), size)
+
+
+def encode_file_meta(name, size):
+    '''Кодирует FILE_META в фиксированную двоичную раскладку.'''
+    raw = name.encode()
+    return _FILE_META.pack(size, len(raw)) + raw
+
+
+def encode_peers(peers):
+    '''Кодирует список (host, port, nick) для PEER_LIST/PEER_ADD/PEER_REMOVE.'''
+    parts = [_PEER_COUNT.pack(len(peers))]
+    for host, port, nick in peers:
+        h, n = host.encode(), nick.encode()
+        parts += (_PEER_ENTRY.pack(len(h), port, len(n)), h, n)
+    return b''.join(parts)
+
+
+def decode_peers(data):
+    '''Разбирает закодированный encode_peers() список в кортежи (host, port, nick).'''
+    (count,) = _PEER_COUNT.unpack_from(data)
+    off = _PEER_COUNT.size
+    peers = []
+    for _ in range(count):
+        host_len, port, nick_len = _PEER_ENTRY.unpack_from(data, off)
+        off += _PEER_ENTRY.size
+        host = str(data[off:off + host_len], 'utf-8')
+        off += host_len
+        nick = str(data[off:off + nick_len], 'utf-8')
+        off += nick_len
+        peers.append((host, port, nick))
+    return peers
+
+
+def encode_history(lines):
+    '''
+    Упаковывает строки истории в полезные нагрузки HISTORY_BULK, каждая не длиннее MAX_FRAME.
+    Строка, которая сама не влезает в кадр, обрезается (без разрыва символа UTF-8).
+    '''
+    limit = MAX_FRAME - _LINE_LEN.size
+    parts, size = [], 0
+    for line in lines:
+        raw = line.encode()
+        if len(raw) > limit:
+            raw = raw[:limit].decode('utf-8', 'ignore').encode()
+        if parts and size + _LINE_LEN.size + len(raw) > MAX_FRAME:
+            yield b''.join(parts)
+            parts, size = [], 0
+        parts += (_LINE_LEN.pack(len(raw)), raw)
+        size += _LINE_LEN.size + len(raw)
+    if parts:
+        yield b''.join(parts)
+
+
+def decode_history(data):
+    '''Разбирает полезную нагрузку HISTORY_BULK в список строк.'''
+    lines, off, end = [], 0, len(data)
+    while off < end:
+        (n,) = _LINE_LEN.unpack_from(data, off)
+        off += _LINE_LEN.size
+        lines.append(str(data[off:off + n], 'utf-8'))
+        off += n
+    return lines
+
+
+def _noop(peer_id, data):
+    '''Обработчик для кадров без полезной нагрузки (HEARTBEAT и т.п.).'''
+
+
+class PeerState:
+    '''
+    Состояние чтения одного соединения в цикле селектора.
+
+    Байты принимаются через recv_into в постоянный буфер; кадры отдаются
+    обработчикам срезами memoryview без копирования. Буфер уплотняется,
+    только когда прочитанная часть занимает больше половины.
+    '''
+    def __init__(self, sock, peer_id, addr, size=65536):
+        self.sock = sock
+        self.peer_id = peer_id
+        self.addr = addr
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.rd = 0
+        self.wr = 0
+
+    def recv(self):
+        '''Один recv_into в свободный хвост буфера. Возвращает число байт (0 — соединение закрыто).'''
+        if self.wr == len(self.buf):
+            if self.rd:
+                self._compact()
+            else:
+                self._grow(2 * len(self.buf))
+        n = self.sock.recv_into(self.view[self.wr:])
+        self.wr += n
+        return n
+
+    def frames(self):
+        '''Выдаёт полные кадры (tag, memoryview) из буфера. Срез действителен до следующего recv.'''
+        while self.wr - self.rd >= _HDR.size:
+            tag, length = _HDR.unpack_from(self.buf, self.rd)
+            if length > MAX_FRAME:
+                raise ValueError(f'кадр слишком большой: {length}')
+            start = self.rd + _HDR.size
+            end = start + length
+            if end > self.wr:
+                if _HDR.size + length > len(self.buf):
+                    self._grow(_HDR.size + length)
+                break
+            self.rd = end
+            yield tag, self.view[start:end]
+        if self.rd == self.wr:
+            self.rd = self.wr = 0
+        elif self.rd > len(self.buf) // 2:
+            self._compact()
+
+    def _compact(self):
+        pending = self.wr - self.rd
+        self.buf[:pending] = self.buf[self.rd:self.wr]
+        self.rd, self.wr = 0, pending
+
+    def _grow(self, size):
+        pending = self.wr - self.rd
+        buf = bytearray(size)
+        buf[:pending] = self.view[self.rd:self.wr]
+        self.buf, self.view = buf, memoryview(buf)
+        self.rd, self.wr = 0, pending
+
+
+class FileRx:
+    '''Приём одного файла от пира: открытый файл, ожидаемый размер и счётчик принятых байт.'''
+    __slots__ = ('file', 'name', 'size', 'received', 'path')
+
+    def __init__(self, file, name, size, path):
+        self.file = file
+        self.name = name
+        self.size = size
+        self.received = 0
+        self.path = path
+
 
 class NetworkManager:
-    def __init__(self, host, port, gui_callback, debug=False):
-        '''Инициализирует сетевой менеджер с историей и приёмом файлов.'''
+    '''
+    Узел P2P-чата: слушающий сокет, соединения с пирами и цикл селектора.
+
+    Очередь входящих соединений — LISTEN_BACKLOG; ядро урезает её до net.core.somaxconn,
+    поэтому при всплесках подключений стоит поднять somaxconn и net.core.netdev_max_backlog.
+    '''
+    HISTORY_LIMIT = 1000
+    LISTEN_BACKLOG = 1024
+
+    def __init__(self, host, port, gui_callback, debug=False, socket_options=(),
+                 sock_buffer_size=SOCK_BUF):
+        '''
+        Инициализирует сетевой менеджер с историей и приёмом файлов.
+
+        socket_options — дополнительные (level, option, value) для каждого сокета пира;
+        sock_buffer_size — SO_SNDBUF/SO_RCVBUF сокетов пиров (ограничен net.core.*mem_max).
+        '''
         self.host = host
         self.port = port
         self.gui_callback = gui_callback
         self.nickname = f'User_{port}'
         self.debug = debug
+        self.socket_options = tuple(socket_options)
+        self.sock_buffer_size = sock_buffer_size
         self.peers = {}
         self.connection_map = {}
         self.peer_nicks = {}
+        self.known_peers = {}
+        self.in_flight = set()
+        self._connect_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix='connect')
         self.lock = threading.Lock()
         self.running = True
-        self.heartbeat_interval = 5
-        self.connection_id = str(uuid.uuid4())
+        self.heartbeat_interval = None  # живость проверяет TCP keepalive; число секунд включает HEARTBEAT
+        self.peer_list_interval = 0.25
+        self._peers_dirty = False
+        self._last_peer_list = 0.0
+        self.last_rx = {}
+        self.last_tx = {}
+        self.handshake_timeout = 30
+        self.send_timeout = 10
+        self.connection_id = os.urandom(16)
         self.current_files = {}
-        self.chat_history = []
+        self.file_offers = {}
+        self.chat_history = deque(maxlen=self.HISTORY_LIMIT)
         self.is_host = True
         self.pending_file = None
         self.pending_file_name = None
+        self.file_chunk_size = 1 << 20
+        self.send_locks = {}
+        self.send_queues = {}
+        self._tls = threading.local()
+        self.selector = selectors.DefaultSelector()
+        self.recv_size = 65536
+        self._dispatch = {
+            b'TEXT': self.handle_text,
+            b'FMTA': self._on_file_meta,
+            b'FDAT': self.handle_file_data,
+            b'FACC': self._on_file_accept,
+            b'FDEC': self._on_file_decline,
+            b'CLRH': self._on_clear_history,
+            b'NICK': self.handle_nick_change,
+            b'PERS': self._on_peer_list,
+            b'PADD': self._on_peer_add,
+            b'PREM': self._on_peer_remove,
+            b'HIST': self._on_history,
+            b'BEAT': _noop,
+            b'CONN': _noop,
+        }
 
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.sock_buffer_size)
         self.sock.bind((self.host, self.port))
-        self.sock.listen(5)
+        self.sock.listen(self.LISTEN_BACKLOG)
+        self.sock.setblocking(False)
         self.server_ip = self.sock.getsockname()[0]
-        if self.debug:
-            print(f"[DEBUG] Сервер на {self.server_ip}:{self.port} (ID={self.connection_id[:8]})")
-
-        threading.Thread(target=self.accept_connections, daemon=True).start()
-        threading.Thread(target=self.heartbeat, daemon=True).start()
-
-    def accept_connections(self):
-        '''Принимает входящие соединения и отправляет историю только если хост.'''
-        while self.running:
+        self._self_addrs = frozenset(
+            (h, self.port) for h in ('localhost', '127.0.0.1', self.host, self.server_ip)
+        )
+        self._handshake_cache = self._build_handshake()
+        self._peer_list_cache = None
+        self._gui_peers_cache = None
+        self._peers_snapshot = {}
+        self._peer_addrs = frozenset()
+        logger.debug('Сервер на %s:%s (ID=%s)', self.server_ip, self.port, self.connection_id.hex()[:8])
+
+        self.selector.register(self.sock, selectors.EVENT_READ, None)
+        threading.Thread(target=self.event_loop, daemon=True).start()
+
+    def accept_connection(self):
+        '''Принимает все ожидающие соединения (слушающий сокет готов) и запускает для них handshake.'''
+        while True:
             try:
                 conn, addr = self.sock.accept()
+            except OSError:
+                return
+            try:
+                tune_socket(conn, self.sock_buffer_size, self.socket_options)
                 threading.Thread(
                     target=self._on_new_connection,
                     args=(conn, addr),
                     daemon=True
                 ).start()
-            except OSError:
-                break
             except Exception as e:
-                print(f'Ошибка accept: {e}')
-    
+                logger.error('Ошибка accept: %s', e)
+                conn.close()
 
     def _on_new_connection(self, conn, addr):
-        peer_id, peer_addr = self._do_handshake(conn, addr)
+        conn.settimeout(self.handshake_timeout)
+        try:
+            peer_id, peer_addr = self._do_handshake(conn, addr)
+        except (OSError, RuntimeError, ValueError, KeyError):
+            peer_id = None
         if not peer_id:
             conn.close()
             return
+        conn.settimeout(None)
+        set_send_timeout(conn, self.send_timeout)
 
         if self.is_host:
             with self.lock:
-                for msg in self.chat_history:
-                    hdr = MessageType.TEXT.value.encode() + len(msg.encode()).to_bytes(4,'big')
-                    try:
-                        send_all(conn, hdr + msg.encode())
-                    except Exception:
-                        self.remove_peer(peer_id)
-                        return
+                history = list(self.chat_history)
+            try:
+                for payload in encode_history(history):
+                    self.send_message(MessageType.HISTORY_BULK, payload, conn)
+            except Exception:
+                self.remove_peer(peer_id)
+                return
 
-        self.handle_messages(conn, peer_id, peer_addr)
+        self._register_peer(conn, peer_id, peer_addr)
 
 
 
-    def _do_handshake(self, conn, addr):
-        header = receive_all(conn, 8)
+    def _read_handshake(self, sock, default_nick, default_port):
+        '''
+        Читает кадр CONNECTION_ID; None — если пришло другое.
+        Весь кадр должен прийти за handshake_timeout, иначе пир, присылающий по байту, держал бы поток вечно.
+        '''
+        deadline = time.monotonic() + self.handshake_timeout
+        header = receive_all(sock, _HDR.size, deadline=deadline)
         if not header:
+            return None
+        tag, ln = _HDR.unpack_from(header)
+        if _TAG_TYPES.get(tag) != MessageType.CONNECTION_ID or ln > MAX_FRAME:
+            return None
+        data = receive_all(sock, ln, deadline=deadline)
+        if not data:
+            return None
+        hs = parse_handshake(data, default_nick, default_port)
+        if hs.conn_id == self.connection_id or hs.conn_id in self.peers:
+            return None
+        return hs
+
+    def _do_handshake(self, conn, addr):
+        hs = self._read_handshake(conn, f'User_{addr[1]}', addr[1])
+        if hs is None:
             return None, None
-        mt = MessageType(header[:4].decode())
-        ln = int.from_bytes(header[4:8], 'big')
-        data = receive_all(conn, ln)
-        if mt != MessageType.CONNECTION_ID or not data:
-            return None, None
-        info = json.loads(data.decode())
-        peer_id = info['conn_id']
-        peer_nick = info.get('nickname', f'User_{addr[1]}')
-        peer_port = info.get('listen_port', addr[1])
-        if peer_id == self.connection_id or peer_id in self.peers:
-            return None, None
+        peer_id, peer_nick, peer_port = hs
 
-        resp = json.dumps({
-            'conn_id': self.connection_id,
-            'nickname': self.nickname,
-            'listen_port': self.port
-        }).encode()
-        self.send_message(MessageType.CONNECTION_ID, resp, conn)
+        self.send_message(MessageType.CONNECTION_ID, self._handshake_cache, conn)
 
         with self.lock:
             self.peers[peer_id] = (conn, (addr[0], peer_port))
             self.connection_map[(addr[0], peer_port)] = peer_id
             self.peer_nicks[peer_id] = peer_nick
+            self._peers_changed()
 
         self.gui_callback('message', f'{peer_nick} подключился')
         self.chat_history.append(f'{peer_nick} подключился')
-        self.send_peer_list()
+        self.send_peer_list(conn)
+        self.send_peer_delta(MessageType.PEER_ADD, addr[0], peer_port, peer_nick, exclude=peer_id)
         self.gui_callback('update_peers', self.get_peer_list())
         return peer_id, (addr[0], peer_port)
 
 
-
-    def _handle_connect_send_history(self, conn, addr):
-        '''Обрабатывает соединение и шлет историю.'''
-        self.handle_incoming_connection(conn, addr)
-        for msg in self.chat_history:
-            header = MessageType.TEXT.value.encode() + len(msg.encode()).to_bytes(4, 'big')
-            send_all(conn, header + msg.encode())
-
-    def handle_incoming_connection(self, conn, addr):
-        '''Обрабатывает входящее соединение.'''
-        peer_id = None
-        try:
-            header = receive_all(conn, 8)
-            if not header:
-                return
-            msg_type = MessageType(header[:4].decode())
-            length = int.from_bytes(header[4:8], 'big')
-            data = receive_all(conn, length)
-            if msg_type != MessageType.CONNECTION_ID or not data:
-                return
-
-            info = json.loads(data.decode())
-            peer_id = info['conn_id']
-            peer_nick = info.get('nickname', f'User_{addr[1]}')
-            peer_port = info.get('listen_port', addr[1])
-            if peer_id == self.connection_id:
-                return
-
-            with self.lock:
-                if peer_id in self.peers:
-                    conn.close()
-                    return
-                response = json.dumps({
-                    'conn_id': self.connection_id,
-                    'nickname': self.nickname,
-                    'listen_port': self.port
-                }).encode()
-                self.send_message(MessageType.CONNECTION_ID, response, conn)
-                self.peers[peer_id] = (conn, (addr[0], peer_port))
-                self.connection_map[(addr[0], peer_port)] = peer_id
-                self.peer_nicks[peer_id] = peer_nick
-
-            self.gui_callback('message', f'{peer_nick} подключился')
-            self.chat_history.append(f'{peer_nick} подключился')
-            self.send_peer_list()
-            self.gui_callback('update_peers', self.get_peer_list())
-            self.handle_messages(conn, peer_id, (addr[0], peer_port))
-        except Exception as e:
-            print(f'Ошибка входящего соединения: {e}')
-        finally:
-            if peer_id is None:
-                try:
-                    conn.close()
-                except:
-                    pass
-
-
     def handle_file_meta(self, peer_id, data):
-        '''Обрабатывает метаданные входящего файла.'''
-        info = json.loads(data.decode())
-        name, size = info['name'], info['size']
-        os.makedirs('downloads', exist_ok=True)
-        path = os.path.join('downloads', name)
-        base, ext = os.path.splitext(name)
-        count = 1
-        while os.path.exists(path):
-            path = os.path.join('downloads', f"{base}_{count}{ext}")
-            count += 1
-        f = open(path, 'wb')
-        self.current_files[peer_id] = {'file': f, 'size': size, 'received': 0, 'path': path}
+        '''Запоминает предложение файла до ответа пользователя и возвращает разобранный FileMeta.'''
+        name, size = parse_file_meta(data)
+        name = os.path.basename(name.replace('\\', '/')) or 'file'
+        meta = FileMeta(name, size)
+        self.file_offers[peer_id] = meta
         self.gui_callback('message', f"{self.peer_nicks.get(peer_id, '?')} отправляет файл: {name}")
+        return meta
+
+    def _open_incoming(self, meta):
+        '''Атомарно создаёт файл под принятое предложение (свободное имя в downloads) и резервирует место.'''
+        os.makedirs('downloads', exist_ok=True)
+        path = os.path.join('downloads', meta.name)
+        base, ext = os.path.splitext(meta.name)
+        count = 0
+        while True:
+            try:
+                fd = os.open(path, _CREATE_FLAGS, 0o644)
+                break
+            except FileExistsError:
+                count += 1
+                path = os.path.join('downloads', f"{base}_{count}{ext}")
+        f = os.fdopen(fd, 'wb', buffering=1 << 20)
+        if meta.size and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(f.fileno(), 0, meta.size)
+            except OSError:
+                pass
+        return FileRx(f, meta.name, meta.size, path)
+
+    def _discard_incoming(self, peer_id):
+        '''Забывает предложение пира и удаляет недокачанный файл.'''
+        self.file_offers.pop(peer_id, None)
+        rx = self.current_files.pop(peer_id, None)
+        if rx is not None:
+            rx.file.close()
+            try:
+                os.unlink(rx.path)
+            except OSError:
+                pass
 
+    def _register_peer(self, conn, peer_id, addr):
+        '''Передаёт соединение после handshake в цикл селектора.'''
+        self.selector.register(conn, selectors.EVENT_READ, PeerState(conn, peer_id, addr, self.recv_size))
 
-    def handle_messages(self, conn, peer_id, addr):
-        '''Обрабатывает входящие сообщения.'''
+    def event_loop(self):
+        '''
+        Единый цикл: приём соединений и чтение всех пиров через selectors (epoll/kqueue),
+        отправка HEARTBEAT и не чаще peer_list_interval — накопленной рассылки PEER_LIST.
+        '''
+        next_beat = self._next_heartbeat(time.monotonic())
         try:
             while self.running:
-                ready, _, _ = select.select([conn], [], [], 5.0)
-                if not ready:
-                    continue
+                now = time.monotonic()
+                deadline = next_beat
+                if self._peers_dirty:
+                    deadline = min(deadline, self._last_peer_list + self.peer_list_interval)
+                timeout = min(1.0, max(0.0, deadline - now))
+                try:
+                    events = self.selector.select(timeout)
+                except OSError:
+                    events = []
+                for key, _ in events:
+                    if key.data is None:
+                        self.accept_connection()
+                    else:
+                        self._on_readable(key.data)
+
+                now = time.monotonic()
+                # Периодические рассылки идут в том же потоке, что и всё чтение: их ошибка
+                # не должна останавливать цикл, как и ошибка обработчика в _on_readable.
+                try:
+                    if now >= next_beat:
+                        next_beat = self._next_heartbeat(now)
+                        self._send_heartbeats()
+                    if self._peers_dirty and now - self._last_peer_list >= self.peer_list_interval:
+                        self._peers_dirty = False
+                        self._last_peer_list = now
+                        self.send_peer_list()
+                except Exception as e:
+                    logger.debug('Ошибка периодической рассылки: %s', e)
+        finally:
+            self.selector.close()
+
+    def _next_heartbeat(self, now):
+        '''Срок следующей рассылки HEARTBEAT; без heartbeat_interval — никогда.'''
+        return now + self.heartbeat_interval if self.heartbeat_interval else float('inf')
+
+    def _send_heartbeats(self):
+        '''Шлёт HEARTBEAT только по простаивающим связям: ни приёма, ни отправки дольше интервала.'''
+        logger.debug('heartbeat')
+        now = time.monotonic()
+        failed = []
+        for pid, (s, _, _) in self._peers_snapshot.items():
+            last = max(self.last_rx.get(pid, 0.0), self.last_tx.get(s, 0.0))
+            if now - last <= self.heartbeat_interval:
+                continue
+            try:
+                with self._sending(s):
+                    send_all(s, _HEARTBEAT_FRAME)
+                self.last_tx[s] = now
+            except Exception:
+                failed.append(pid)
+        for pid in failed:
+            self.remove_peer(pid)
+
+    def _on_readable(self, state):
+        '''Читает доступные байты пира и обрабатывает все полные кадры.'''
+        try:
+            received = state.recv()
+        except (BlockingIOError, socket.timeout):
+            return
+        except OSError:
+            received = 0
+        if not received:
+            self.remove_peer(state.peer_id)
+            return
+        self.last_rx[state.peer_id] = time.monotonic()
 
-                header = receive_all(conn, 8)
-                if not header:
-                    break
+        try:
+            for tag, data in state.frames():
+                handler = self._dispatch.get(tag)
+                if handler:
+                    try:
+                        handler(state.peer_id, data)
+                    except Exception as e:
+                        logger.debug('Ошибка обработки %r от %s: %s', tag, state.addr, e)
+        except ValueError as e:
+            self.gui_callback('debug', f'{e} от {state.addr}')
+            self.remove_peer(state.peer_id)
+
+    def handle_text(self, peer_id, data):
+        '''Обрабатывает текстовое сообщение.'''
+        text = str(data, 'utf-8')
+        self.gui_callback('message', text)
+        self.chat_history.append(text)
+
+    def _on_history(self, peer_id, data):
+        '''Принимает историю чата, присланную хостом при подключении, одним кадром.'''
+        lines = decode_history(data)
+        self.chat_history.extend(lines)
+        for line in lines:
+            self.gui_callback('message', line)
+
+    def _on_file_meta(self, peer_id, data):
+        '''Пересылает метаданные файла (если хост) и спрашивает о приёме.'''
+        if self.is_host:
+            self.send_message(MessageType.FILE_META, data, exclude=peer_id)
+        meta = self.handle_file_meta(peer_id, data)
+        threading.Thread(
+            target=self.gui_callback,
+            args=('file_request', (peer_id, meta.name, meta.size)),
+            daemon=True
+        ).start()
+
+    def _on_file_accept(self, peer_id, data):
+        '''Пир согласился принять файл — начинаем передачу.'''
+        accepter = self.peer_nicks.get(peer_id, '?')
+        notify = f'Пользователь {accepter} получил файл {self.pending_file_name}'
+        self.send_message(MessageType.TEXT, notify.encode())
+        self.gui_callback('message', notify)
+        threading.Thread(target=self._send_file_data, args=(peer_id,), daemon=True).start()
 
-                msg_type = MessageType(header[:4].decode())
-                length = int.from_bytes(header[4:8], 'big')
-                data = b''
-                if length > 0:
-                    data = receive_all(conn, length)
-                    if data is None:
-                        break
+    def _on_file_decline(self, peer_id, data):
+        '''Пир отказался от файла.'''
+        decliner = self.peer_nicks.get(peer_id, '?')
+        notify = f'Пользователь {decliner} отклонил файл {self.pending_file_name}'
+        self.send_message(MessageType.TEXT, notify.encode())
+        self.gui_callback('message', notify)
 
-                if msg_type == MessageType.HEARTBEAT:
-                    continue
+    def _on_clear_history(self, peer_id, data):
+        '''Хост очистил историю чата.'''
+        with self.lock:
+            self.chat_history.clear()
+        self.gui_callback('clear_history', None)
+        notify = 'История чата была очищена'
+        self.chat_history.append(notify)
+        self.gui_callback('message', notify)
 
-                if msg_type == MessageType.TEXT:
-                    text = data.decode()
-                    self.gui_callback('message', text)
-                    self.chat_history.append(text)
-
-                elif msg_type == MessageType.FILE_META:
-                    raw_header = msg_type.value.encode() + length.to_bytes(4, 'big')
-                    if self.is_host:
-                        with self.lock:
-                            for pid, (sock, _) in self.peers.items():
-                                if pid == peer_id:
-                                    continue
-                                try:
-                                    send_all(sock, raw_header + data)
-                                except Exception:
-                                    pass
-                    self.handle_file_meta(peer_id, data)
-                    meta = json.loads(data.decode())
-                    self.gui_callback('file_request', (peer_id, meta['name'], meta['size']))
-
-                elif msg_type == MessageType.FILE_ACCEPT:
-                    accepter = self.peer_nicks.get(peer_id, '?')
-                    notify = f'Пользователь {accepter} получил файл {self.pending_file_name}'
-                    self.send_message(MessageType.TEXT, notify.encode())
-                    self.gui_callback('message', notify)
-                    threading.Thread(target=self._send_file_data, args=(peer_id,), daemon=True).start()
-
-                elif msg_type == MessageType.FILE_DECLINE:
-                    decliner = self.peer_nicks.get(peer_id, '?')
-                    notify = f'Пользователь {decliner} отклонил файл {self.pending_file_name}'
-                    self.send_message(MessageType.TEXT, notify.encode())
-                    self.gui_callback('message', notify)
-
-                elif msg_type == MessageType.FILE_DATA:
-                    info = self.current_files.get(peer_id)
-                    if info:
-                        info['file'].write(data)
-                        info['received'] += len(data)
-                        if info['received'] >= info['size']:
-                            info['file'].close()
-                            path = info['path']
-                            self.gui_callback('message', f'Файл сохранён по: {path}')
-                            del self.current_files[peer_id]
-
-                elif msg_type == MessageType.CLEAR_HISTORY:
-                    with self.lock:
-                        self.chat_history.clear()
-                    self.gui_callback('clear_history', None)
-                    notify = 'История чата была очищена'
-                    self.chat_history.append(notify)
-                    self.gui_callback('message', notify)
-
-                elif msg_type == MessageType.NICK:
-                    newnick = data.decode()
-                    with self.lock:
-                        self.peer_nicks[peer_id] = newnick
-                    self.send_peer_list()
-                    self.gui_callback('update_peers', self.get_peer_list())
-
-                elif msg_type == MessageType.PEER_LIST:
-                    peers = json.loads(data.decode())
-                    gui_peers = [
-                        {'address': f"{p['host']}:{p['port']}", 'nick': p['nick']}
-                        for p in peers
-                    ]
-                    self.gui_callback('update_peers', gui_peers)
+    def handle_nick_change(self, peer_id, data):
+        '''Пир сменил ник (слишком длинный обрезается до MAX_NICK байт).'''
+        newnick = clip_nick(data)
+        with self.lock:
+            self.peer_nicks[peer_id] = newnick
+            self._peers_changed()
+        self._peers_dirty = True
+        self.gui_callback('update_peers', self.get_peer_list())
 
-                else:
-                    continue
+    def _on_peer_list(self, peer_id, data):
+        '''Полная синхронизация: заменяет известный список пиров присланным.'''
+        peers = decode_peers(data)
+        with self.lock:
+            self.known_peers = {(host, port): nick for host, port, nick in peers}
+        self.gui_callback('update_peers', self.get_known_peer_list())
 
-        finally:
-            if peer_id in self.peers:
-                self.remove_peer(peer_id)
+    def _on_peer_add(self, peer_id, data):
+        '''Дельта: в сети появился (или переименовался) пир.'''
+        for host, port, nick in decode_peers(data):
+            with self.lock:
+                self.known_peers[(host, port)] = nick
+        self.gui_callback('update_peers', self.get_known_peer_list())
 
+    def _on_peer_remove(self, peer_id, data):
+        '''Дельта: пир покинул сеть.'''
+        for host, port, _ in decode_peers(data):
+            with self.lock:
+                self.known_peers.pop((host, port), None)
+        self.gui_callback('update_peers', self.get_known_peer_list())
 
-    def send_peer_list(self, conn=None):
-        '''Отправляет список пиров.'''
+    def get_known_peer_list(self):
+        '''Возвращает список пиров сети, собранный из PEER_LIST и дельт.'''
         with self.lock:
-            peers = [
-                {'host': addr[0], 'port': addr[1], 'nick': self.peer_nicks.get(pid, '')}
-                for pid, (_, addr) in self.peers.items()
+            return [
+                {'address': f"{host}:{port}", 'nick': nick}
+                for (host, port), nick in self.known_peers.items()
             ]
-            peers.append({'host': self.server_ip, 'port': self.port, 'nick': self.nickname})
-        data = json.dumps(peers).encode()
+
+    def send_peer_delta(self, msg_type, host, port, nick='', exclude=None):
+        '''Рассылает изменение состава сети (PEER_ADD/PEER_REMOVE) вместо полного списка.'''
+        data = encode_peers([(host, port, nick)])
+        self.send_message(msg_type, data, exclude=exclude)
+
+    def _peers_changed(self):
+        '''
+        Вызывается под self.lock после изменения peers/peer_nicks/своего ника.
+        Публикует новый снимок {peer_id: (sock, addr, nick)}; опубликованный снимок
+        больше не меняется, поэтому читатели обходят его без блокировки.
+        '''
+        self._peers_snapshot = {
+            pid: (s, addr, self.peer_nicks.get(pid, ''))
+            for pid, (s, addr) in self.peers.items()
+        }
+        self._peer_addrs = frozenset(addr for _, addr in self.peers.values())
+
+    def _build_handshake(self):
+        '''Кодирует полезную нагрузку CONNECTION_ID (меняется только вместе с ником).'''
+        return encode_handshake(self.connection_id, self.nickname, self.port)
+
+    def send_peer_list(self, conn=None):
+        '''Отправляет список пиров (закодированный список кешируется до смены снимка).'''
+        snapshot = self._peers_snapshot
+        cached = self._peer_list_cache
+        if cached is not None and cached[0] is snapshot:
+            data = cached[1]
+        else:
+            peers = [(addr[0], addr[1], nick) for _, addr, nick in snapshot.values()]
+            peers.append((self.server_ip, self.port, self.nickname))
+            data = encode_peers(peers)
+            self._peer_list_cache = (snapshot, data)
         self.send_message(MessageType.PEER_LIST, data, conn)
 
     def get_peer_list(self):
-        '''Возвращает список пиров.'''
-        with self.lock:
-            lst = [
-                {'address': f"{addr[0]}:{addr[1]}", 'nick': self.peer_nicks.get(pid, f'User_{addr[1]}')}
-                for pid, (_, addr) in self.peers.items()
-            ]
+        '''Возвращает список пиров (читает снимок без блокировки, кеш до смены снимка; не изменять).'''
+        snapshot = self._peers_snapshot
+        cached = self._gui_peers_cache
+        if cached is not None and cached[0] is snapshot:
+            return cached[1]
+        lst = [
+            {'address': f"{addr[0]}:{addr[1]}", 'nick': nick or f'User_{addr[1]}'}
+            for _, addr, nick in snapshot.values()
+        ]
         lst.append({'address': f"{self.server_ip}:{self.port}", 'nick': self.nickname})
+        self._gui_peers_cache = (snapshot, lst)
         return lst
 
     def connect_to_peer(self, host, port):
-        """Подключается к пиру: handshake → отправка истории → handle_messages."""
-        if host == self.server_ip and port == self.port:
-            return False
-        if self.is_connected_to(host, port):
-            return False
-
+        """Подключается к пиру: handshake → отправка списка пиров → регистрация в цикле селектора."""
         try:
+            if (host, port) in self._self_addrs:
+                return False
+            if self.is_connected_to(host, port):
+                return False
+
             self.connected_host = (host, port)
             sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            tune_socket(sock, self.sock_buffer_size, self.socket_options)
+            sock.settimeout(self.handshake_timeout)
             sock.connect((host, port))
             self.is_host = False
 
-            info = json.dumps({
-                'conn_id': self.connection_id,
-                'nickname': self.nickname,
-                'listen_port': self.port
-            }).encode()
-            self.send_message(MessageType.CONNECTION_ID, info, sock)
+            self.send_message(MessageType.CONNECTION_ID, self._handshake_cache, sock)
 
-            header = receive_all(sock, 8)
-            if not header:
+            hs = self._read_handshake(sock, '', port)
+            if hs is None:
                 sock.close()
                 return False
-            mt = MessageType(header[:4].decode())
-            ln = int.from_bytes(header[4:8], 'big')
-            data = receive_all(sock, ln)
-            if mt != MessageType.CONNECTION_ID or not data:
-                sock.close()
-                return False
-
-            resp = json.loads(data.decode())
-            peer_id   = resp['conn_id']
-            peer_nick = resp.get('nickname', '')
-            peer_port = resp.get('listen_port', port)
+            peer_id, peer_nick, peer_port = hs
 
             with self.lock:
                 if peer_id in self.peers:
                     sock.close()
                     return False
+                sock.settimeout(None)
+                set_send_timeout(sock, self.send_timeout)
                 self.peers[peer_id] = (sock, (host, peer_port))
                 self.connection_map[(host, peer_port)] = peer_id
                 self.peer_nicks[peer_id] = peer_nick
+                self._peers_changed()
 
             self.gui_callback('message', f'{peer_nick} подключился')
             self.chat_history.append(f'{peer_nick} подключился')
             self.send_peer_list(sock)
             self.gui_callback('update_peers', self.get_peer_list())
 
-            threading.Thread(
-                target=self.handle_messages,
-                args=(sock, peer_id, (host, peer_port)),
-                daemon=True
-            ).start()
+            self._register_peer(sock, peer_id, (host, peer_port))
 
             return True
 
         except Exception as e:
-            if self.debug:
-                print(f"[DEBUG] connect_to_peerа ошибка {host}:{port}: {e}")
+            logger.debug('connect_to_peer: ошибка %s:%s: %s', host, port, e)
             return False
+        finally:
+            with self.lock:
+                self.in_flight.discard((host, port))
         
 
     def handle_file_data(self, peer_id, data):
         '''Обрабатывает кусок данных файла.'''
-        info = self.current_files.get(peer_id)
-        if not info:
+        rx = self.current_files.get(peer_id)
+        if rx is None:
             return
-        info['file'].write(data)
-        info['received'] += len(data)
-        if info['received'] >= info['size']:
-            info['file'].close()
-            self.gui_callback('message', f"Файл {info['name']} получен")
+        rx.file.write(data)
+        rx.received += len(data)
+        if rx.received >= rx.size:
+            rx.file.close()
+            self.gui_callback('message', f"Файл {rx.name} получен, сохранён по: {rx.path}")
             del self.current_files[peer_id]
 
 
     def send_text(self, text):
-        '''Отправляет текстовое сообщение.'''
-        self.chat_history.append(f'{self.nickname}: {text}')
-        self.send_message(MessageType.TEXT, f'{self.nickname}: {text}'.encode())
+        '''Отправляет текстовое сообщение; False — если оно не помещается в кадр MAX_FRAME.'''
+        line = f'{self.nickname}: {text}'
+        data = line.encode()
+        if len(data) > MAX_FRAME:
+            return False
+        self.chat_history.append(line)
+        self.send_message(MessageType.TEXT, data)
+        return True
 
     def send_file(self, file_path):
         '''Инициирует передачу файла с запросом.'''
         try:
             size = os.path.getsize(file_path)
             name = os.path.basename(file_path)
-            meta = json.dumps({'name': name, 'size': size}).encode()
+            meta = encode_file_meta(name, size)
             self.pending_file = file_path
             self.pending_file_name = name
             self.send_message(MessageType.FILE_META, meta)
             return True
         except Exception as e:
-            print(f'Ошибка send_file: {e}')
+            logger.error('Ошибка send_file: %s', e)
             return False
 
     def _send_file_data(self, peer_id):
-        '''Отправляет данные файла после принятия.'''
+        '''Отправляет данные файла после принятия: заголовок FILE_DATA + sendfile(2) на каждый кусок.'''
         sock, _ = self.peers[peer_id]
+        tag = _TAGS[MessageType.FILE_DATA]
         with open(self.pending_file, 'rb') as f:
-            while True:
-                chunk = f.read(4096)
-                if not chunk:
-                    break
-                self.send_message(MessageType.FILE_DATA, chunk, sock)
+            size = os.fstat(f.fileno()).st_size
+            offset = 0
+            set_cork(sock, True)
+            try:
+                while offset < size:
+                    count = min(self.file_chunk_size, size - offset)
+                    with self._sending(sock):
+                        send_all(sock, _HDR.pack(tag, count))
+                        sent = send_file_range(sock, f, offset, count)
+                    if sent != count:
+                        raise RuntimeError(f'sendfile отправил {sent} из {count} байт')
+                    offset += count
+            except (OSError, RuntimeError) as e:
+                # Кадр FILE_DATA уже объявил count байт — после недосыла поток рассинхронизирован.
+                logger.debug('Отправка файла %s прервана: %s', peer_id, e)
+                self.remove_peer(peer_id)
+            finally:
+                set_cork(sock, False)
 
     def respond_file(self, peer_id, accept):
-        '''Вызывается GUI: принять или отклонить файл.'''
+        '''
+        Вызывается GUI: принять или отклонить файл.
+
+        Файл создаётся и место под него резервируется только после согласия
+        и только если объявленный размер помещается на диск.
+        '''
         sock, _ = self.peers[peer_id]
-        if accept:
-            info = self.current_files.get(peer_id)
-            info['path'] = info.get('path')
+        meta = self.file_offers.pop(peer_id, None)
+        if accept and meta is not None:
+            os.makedirs('downloads', exist_ok=True)
+            if meta.size > shutil.disk_usage('downloads').free:
+                self.gui_callback('message', f'Недостаточно места для файла {meta.name} ({meta.size} байт)')
+                accept = False
+            else:
+                self.current_files[peer_id] = self._open_incoming(meta)
+        if accept and meta is not None:
             self.send_message(MessageType.FILE_ACCEPT, b'', sock)
         else:
             self.send_message(MessageType.FILE_DECLINE, b'', sock)
 
-    def send_message(self, msg_type, data, sock=None):
-        '''Упаковывает и отправляет сообщение.'''
-        packet = msg_type.value.encode() + len(data).to_bytes(4, 'big') + data
+    def send_message(self, msg_type, data, sock=None, exclude=None):
+        '''
+        Упаковывает и отправляет сообщение (всем пирам, кроме exclude, если sock не задан).
+
+        :raises ValueError: если данные длиннее MAX_FRAME — получатель всё равно отверг бы кадр и отключил нас
+        '''
+        if len(data) > MAX_FRAME:
+            raise ValueError(f'кадр слишком большой: {len(data)} байт')
+        header = getattr(self._tls, 'header', None)
+        if header is None:
+            header = self._tls.header = bytearray(_HDR.size)
+        _HDR.pack_into(header, 0, _TAGS[msg_type], len(data))
+        buffers = (header, data)
         if sock:
-            send_all(sock, packet)
-        else:
-            with self.lock:
-                for pid, (s, _) in list(self.peers.items()):
+            with self._sending(sock):
+                send_all_vec(sock, buffers)
+            return
+
+        now = time.monotonic()
+        failed = []
+        frame = None
+        for pid, (s, _, _) in self._peers_snapshot.items():
+            if pid == exclude:
+                continue
+            try:
+                lock = self._send_lock(s)
+                if lock.acquire(blocking=False):
                     try:
-                        send_all(s, packet)
-                    except Exception:
-                        self.remove_peer(pid)
+                        self._flush_queued(s)
+                        send_all_vec(s, buffers)
+                    finally:
+                        lock.release()
+                else:
+                    # Сокет занят (например, куском файла): кадр уйдёт сразу после него,
+                    # цикл событий не ждёт, а занятость не считается отказом пира.
+                    if frame is None:
+                        frame = bytes(header) + bytes(data)
+                    self.send_queues.setdefault(s, deque()).append(frame)
+                self._drain(s)
+                self.last_tx[s] = now
+            except Exception:
+                failed.append(pid)
+        for pid in failed:
+            self.remove_peer(pid)
+
+    def _send_lock(self, sock):
+        '''Возвращает блокировку записи сокета, чтобы кадры разных потоков не перемешивались.'''
+        lock = self.send_locks.get(sock)
+        if lock is None:
+            lock = self.send_locks.setdefault(sock, threading.Lock())
+        return lock
+
+    @contextmanager
+    def _sending(self, sock):
+        '''Захватывает блокировку записи; до своего кадра и после освобождения досылает отложенные.'''
+        with self._send_lock(sock):
+            self._flush_queued(sock)
+            yield
+        self._drain(sock)
+
+    def _flush_queued(self, sock):
+        '''Отправляет кадры, отложенные рассылкой, пока сокет был занят (блокировка уже захвачена).'''
+        queue = self.send_queues.get(sock)
+        while queue:
+            send_all(sock, queue.popleft())
+
+    def _drain(self, sock):
+        '''После освобождения блокировки: досылает отложенное, если сокет никто не занял снова.'''
+        lock = self._send_lock(sock)
+        while self.send_queues.get(sock):
+            if not lock.acquire(blocking=False):
+                return
+            try:
+                self._flush_queued(sock)
+            finally:
+                lock.release()
 
     def clear_history(self):
         '''Вызывается хозяином для ручной очистки истории у всех.'''
         with self.lock:
             self.chat_history.clear()
         self.gui_callback('clear_history', None)
-        hdr = MessageType.CLEAR_HISTORY.value.encode() + (0).to_bytes(4,'big')
-        with self.lock:
-            for _, (s, _) in list(self.peers.items()):
-                try:
-                    send_all(s, hdr)
-                except Exception:
-                    pass
+        self.send_message(MessageType.CLEAR_HISTORY, b'')
         notify = 'История чата была очищена'
         with self.lock:
             self.chat_history.append(notify)
         self.gui_callback('message', notify)
     
     def change_nickname(self, new_nick):
-        '''Меняет ник и оповещает сеть.'''
+        '''Меняет ник и оповещает сеть; False — если ник длиннее MAX_NICK байт.'''
+        if len(new_nick.encode()) > MAX_NICK:
+            return False
         self.nickname = new_nick
+        self._handshake_cache = self._build_handshake()
+        with self.lock:
+            self._peers_changed()
         self.send_message(MessageType.NICK, new_nick.encode())
         self.gui_callback('update_peers', self.get_peer_list())
-
-    def heartbeat(self):
-        '''Отправляет HEARTBEAT через интервалы.'''
-        while self.running:
-            time.sleep(self.heartbeat_interval)
-            try:
-                if self.debug:
-                    print('[DEBUG] heartbeat')
-                self.send_message(MessageType.HEARTBEAT, b'')
-            except:
-                pass
+        return True
 
     def is_connected_to(self, host, port):
         '''Проверяет наличие подключения.'''
-        with self.lock:
-            return (host, port) in self.connection_map
+        return (host, port) in self._peer_addrs
         
     def remove_peer(self, peer_id):
         '''Удаляет пира и оповещает всех.'''
@@ -490,7 +922,17 @@ class NetworkManager:
                 return
             sock, addr = self.peers.pop(peer_id)
             nick = self.peer_nicks.pop(peer_id, 'Unknown')
+            self.last_rx.pop(peer_id, None)
+            self._peers_changed()
             self.connection_map.pop(addr, None)
+        self.send_locks.pop(sock, None)
+        self.send_queues.pop(sock, None)
+        self.last_tx.pop(sock, None)
+        self._discard_incoming(peer_id)
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError, RuntimeError):
+            pass
         try:
             sock.close()
         except:
@@ -498,39 +940,40 @@ class NetworkManager:
         msg = f"{nick} отключился"
         self.send_message(MessageType.TEXT, msg.encode())
         self.gui_callback('message', msg)
-        self.send_peer_list()
+        self.send_peer_delta(MessageType.PEER_REMOVE, addr[0], addr[1])
         self.gui_callback('update_peers', self.get_peer_list())
 
 
     def stop(self):
         '''Останавливает менеджер.'''
         self.running = False
+        self._connect_pool.shutdown(wait=False)
         try:
             self.sock.close()
         except:
             pass
         with self.lock:
-            for pid in list(self.peers.keys()):
-                self.remove_peer(pid)
+            peer_ids = list(self.peers.keys())
+        for pid in peer_ids:
+            self.remove_peer(pid)
 
 
     def handle_peer_list(self, data):
         '''Обрабатывает список пиров: обновляем GUI и (опционально) подключаемся.'''
         try:
-            peers = json.loads(data.decode())
+            peers = decode_peers(data)
         except Exception:
             return
 
-        gui_peers = [
-            {'address': f"{p['host']}:{p['port']}", 'nick': p['nick']}
-            for p in peers
-        ]
-        self.gui_callback('update_peers', gui_peers)
-
-        for p in peers:
-             host, port = p['host'], p['port']
-             if host == self.server_ip and port == self.port: continue
-             if not self.is_connected_to(host, port):
-                 threading.Thread(target=self.connect_to_peer,
-                                  args=(host, port),
-                                  daemon=True).start()
\ No newline at end of file
+        with self.lock:
+            self.known_peers = {(host, port): nick for host, port, nick in peers}
+        self.gui_callback('update_peers', self.get_known_peer_list())
+
+        for host, port, _ in peers:
+            if (host, port) in self._self_addrs:
+                continue
+            with self.lock:
+                if (host, port) in self.connection_map or (host, port) in self.in_flight:
+                    continue
+                self.in_flight.add((host, port))
+            self._connect_pool.submit(self.connect_to_peer, host, port)
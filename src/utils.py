@@ -4,41 +4,97 @@
 Содержит безопасные методы отправки, получения и сохранения файлов.
 '''
 import os
-import select
 import socket
+import struct
 import time
 
 
-def receive_all(sock, length):
+def receive_all(sock, length, deadline=None):
     '''
-    Получает точно заданное количество байт из сокета с таймаутом.
+    Получает точно заданное количество байт из сокета.
+    Данные читаются через recv_into прямо в буфер, без склейки bytes;
+    ограничение по времени задаётся снаружи через sock.settimeout()
+    или общим сроком deadline, от которого перед каждым recv остаётся всё меньше.
 
     :param sock: сокет
     :param length: количество байт
-    :return: полученные данные (bytes) или None при ошибке/таймауте
+    :param deadline: необязательный момент time.monotonic(), после которого чтение прекращается
+    :return: bytearray с данными, либо None при ошибке/таймауте
     '''
-    data = b''
-    start_time = time.time()
-    while len(data) < length:
-        if time.time() - start_time > 300.0:
+    buf = bytearray(length)
+    view = memoryview(buf)
+    received = 0
+    while received < length:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            sock.settimeout(remaining)
+        try:
+            n = sock.recv_into(view[received:length])
+        except (ConnectionResetError, BrokenPipeError, OSError):
             return None
+        if not n:
+            return None
+        received += n
+
+    return buf
+
+
+# Параметры TCP keepalive: простой, интервал проб, число проб (где ОС их поддерживает)
+KEEPALIVE_OPTIONS = (('TCP_KEEPIDLE', 5), ('TCP_KEEPINTVL', 2), ('TCP_KEEPCNT', 3))
+
+
+def tune_socket(sock, buffer_size=2 << 20, options=()):
+    '''
+    Настраивает сокет пира: отключает Nagle, увеличивает буферы, включает keepalive.
+    Проверку живости простаивающего соединения берёт на себя ядро.
+
+    :param sock: TCP-сокет
+    :param buffer_size: размер SO_SNDBUF/SO_RCVBUF в байтах
+    :param options: дополнительные кортежи (level, option, value) для setsockopt
+    '''
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, buffer_size)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    for name, value in KEEPALIVE_OPTIONS:
+        if hasattr(socket, name):
+            sock.setsockopt(socket.IPPROTO_TCP, getattr(socket, name), value)
+    for level, option, value in options:
+        sock.setsockopt(level, option, value)
+
+
+def set_cork(sock, enabled):
+    '''
+    Включает/выключает TCP_CORK (только Linux), чтобы ядро склеивало кадры в полные сегменты.
 
+    :param sock: TCP-сокет
+    :param enabled: True — придерживать отправку, False — отпустить накопленное
+    '''
+    if hasattr(socket, 'TCP_CORK'):
         try:
-            ready = select.select([sock], [], [], 1.0)
-            if not ready[0]:
-                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, 1 if enabled else 0)
+        except OSError:
+            pass
 
-            remaining = length - len(data)
-            packet = sock.recv(min(4096, remaining))
-            if not packet:
-                return None
-            data += packet
-        except (socket.timeout, BlockingIOError):
-            continue
-        except (ConnectionResetError, BrokenPipeError, OSError):
-            return None
 
-    return data
+def set_send_timeout(sock, seconds):
+    '''
+    Ограничивает блокировку отправки через SO_SNDTIMEO, не переводя сокет в режим таймаута Python
+    (тот добавил бы poll перед каждым recv). Зависшая отправка завершается ошибкой, а не ждёт вечно.
+
+    :param sock: TCP-сокет
+    :param seconds: предельное время одной блокирующей отправки
+    '''
+    if os.name == 'nt':
+        value = struct.pack('I', int(seconds * 1000))
+    else:
+        value = struct.pack('ll', int(seconds), int(seconds % 1 * 1e6))
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, value)
+    except OSError:
+        pass
 
 
 def send_all(sock, data):
@@ -49,15 +105,74 @@ def send_all(sock, data):
     :param data: данные (bytes)
     :raises RuntimeError: если соединение разорвано
     '''
-    total_sent = 0
-    while total_sent < len(data):
+    view = memoryview(data)
+    while view:
+        try:
+            sent = sock.send(view)
+            if sent == 0:
+                raise RuntimeError('Соединение разорвано')
+            view = view[sent:]
+        except (ConnectionResetError, BrokenPipeError, OSError) as e:
+            raise RuntimeError(f'Ошибка отправки: {e}')
+
+
+def send_file_range(sock, f, offset, count):
+    '''
+    Отправляет count байт файла f начиная с offset через os.sendfile в цикле.
+    В отличие от socket.sendfile не ждёт готовности сокета бесконечно: EAGAIN по
+    истечении SO_SNDTIMEO считается ошибкой. Без os.sendfile (Windows) читает и шлёт через send_all.
+
+    :param sock: сокет
+    :param f: файл, открытый на чтение в бинарном режиме
+    :param offset: смещение в файле
+    :param count: сколько байт отправить
+    :return: число фактически отправленных байт (меньше count, если файл закончился раньше)
+    :raises RuntimeError: если соединение разорвано или отправка зависла
+    '''
+    if not hasattr(os, 'sendfile'):
+        f.seek(offset)
+        data = f.read(count)
+        send_all(sock, data)
+        return len(data)
+
+    total = 0
+    while total < count:
+        try:
+            sent = os.sendfile(sock.fileno(), f.fileno(), offset + total, count - total)
+        except OSError as e:
+            raise RuntimeError(f'Ошибка отправки: {e}')
+        if sent == 0:
+            break
+        total += sent
+    return total
+
+
+def send_all_vec(sock, buffers):
+    '''
+    Отправляет несколько буферов одним вызовом sendmsg (scatter-gather),
+    не склеивая их в памяти. Без sendmsg (Windows) склеивает и шлёт через send_all.
+
+    :param sock: сокет
+    :param buffers: последовательность bytes-подобных объектов
+    :raises RuntimeError: если соединение разорвано
+    '''
+    if not hasattr(sock, 'sendmsg'):
+        send_all(sock, b''.join(buffers))
+        return
+
+    views = [memoryview(b) for b in buffers if len(b)]
+    while views:
         try:
-            sent = sock.send(data[total_sent:])
+            sent = sock.sendmsg(views)
             if sent == 0:
                 raise RuntimeError('Соединение разорвано')
-            total_sent += sent
         except (ConnectionResetError, BrokenPipeError, OSError) as e:
             raise RuntimeError(f'Ошибка отправки: {e}')
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
 
 
 def save_file(file_name, data):
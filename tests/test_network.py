@@ -1,8 +1,13 @@
 # tests/test_network.py
-import json
 import os
+import socket
+import threading
+import time
 import pytest
-from src.network import NetworkManager, MessageType
+from src.network import (MAX_FRAME, MAX_NICK, NetworkManager, MessageType, PeerState, decode_peers,
+                         decode_history, encode_file_meta, encode_handshake, encode_history,
+                         encode_peers, parse_file_meta, parse_handshake)
+from src.utils import receive_all
 
 
 class DummyCallback:
@@ -34,24 +39,26 @@ def test_change_nickname(network_manager):
     assert network_manager.nickname == new_nick
     peers = network_manager.get_peer_list()
     assert any(p['nick'] == new_nick for p in peers)
+    assert network_manager.change_nickname('x' * (MAX_NICK + 1)) is False
+    assert network_manager.nickname == new_nick
 
 
 def test_is_connected_to_false(network_manager):
     assert network_manager.is_connected_to('localhost', 12345) is False
 
 
-def test_handle_peer_list_adds_thread(network_manager, monkeypatch):
-    test_data = json.dumps([
-        {'host': '127.0.0.1', 'port': 12345, 'nick': 'peer1'},
-        {'host': 'localhost', 'port': 54321, 'nick': 'peer2'},
-    ]).encode()
+def test_handle_peer_list_submits_connects(network_manager, monkeypatch):
+    test_data = encode_peers([
+        ('127.0.0.1', 12345, 'peer1'),
+        ('localhost', 54321, 'peer2'),
+    ])
 
-    started = []
-    monkeypatch.setattr('threading.Thread',
-                        lambda *args, **kwargs: started.append((args, kwargs)) or type('MockThread', (),
-                                                                                       {'start': lambda s: None})())
+    submitted = []
+    monkeypatch.setattr(network_manager._connect_pool, 'submit',
+                        lambda fn, *args: submitted.append(args))
+    network_manager.handle_peer_list(test_data)
     network_manager.handle_peer_list(test_data)
-    assert len(started) == 2
+    assert submitted == [('127.0.0.1', 12345), ('localhost', 54321)]
 
 
 def test_get_peer_list_structure(network_manager):
@@ -87,9 +94,14 @@ def test_handle_file_meta_and_data(tmp_path, monkeypatch):
     cb = []
     nm = NetworkManager('127.0.0.1', 0, lambda e, d: cb.append((e, d)), debug=False)
     peer_id = 'peer123'
-    meta = json.dumps({'name': 'f.txt', 'size': 5}).encode()
+    meta = encode_file_meta('f.txt', 5)
     nm.handle_file_meta(peer_id, meta)
     assert cb and cb[0][0] == 'message'
+    assert peer_id not in nm.current_files and not os.path.exists('downloads')
+    a, b = socket.socketpair()
+    nm.peers[peer_id] = (a, ('127.0.0.1', 1))
+    nm.respond_file(peer_id, True)
+    assert b.recv(64) == b'FACC\x00\x00\x00\x00'
     nm.handle_file_data(peer_id, b'12')
     assert peer_id in nm.current_files
     nm.handle_file_data(peer_id, b'345')
@@ -100,4 +112,278 @@ def test_handle_file_meta_and_data(tmp_path, monkeypatch):
     files = list(downloads.iterdir())
     assert files and files[0].name.startswith('f.txt')
 
-    nm.stop()
\ No newline at end of file
+    nm.stop()
+
+
+def test_send_file_data_frames(tmp_path, network_manager):
+    path = tmp_path / 'blob.bin'
+    payload = os.urandom(2500)
+    path.write_bytes(payload)
+    a, b = socket.socketpair()
+    try:
+        network_manager.peers['peer'] = (a, ('127.0.0.1', 1))
+        network_manager.pending_file = str(path)
+        network_manager.file_chunk_size = 1000
+        network_manager._send_file_data('peer')
+
+        received = b''
+        while len(received) < len(payload):
+            header = receive_all(b, 8)
+            assert header[:4] == b'FDAT'
+            received += receive_all(b, int.from_bytes(header[4:8], 'big'))
+        assert received == payload
+    finally:
+        network_manager.peers.clear()
+        a.close()
+        b.close()
+
+
+def test_short_sendfile_drops_peer(tmp_path, network_manager, monkeypatch):
+    path = tmp_path / 'blob.bin'
+    path.write_bytes(b'x' * 100)
+    monkeypatch.setattr('src.network.send_file_range', lambda sock, f, offset, count: count - 1)
+    a, b = socket.socketpair()
+    try:
+        network_manager.peers['peer'] = (a, ('127.0.0.1', 1))
+        network_manager.pending_file = str(path)
+        network_manager._send_file_data('peer')
+        assert 'peer' not in network_manager.peers
+    finally:
+        network_manager.peers.clear()
+        a.close()
+        b.close()
+
+
+def test_broadcast_queues_frame_while_socket_is_busy(network_manager):
+    a, b = socket.socketpair()
+    busy, release = threading.Event(), threading.Event()
+
+    def file_chunk():
+        with network_manager._sending(a):
+            busy.set()
+            release.wait(3)
+
+    t = threading.Thread(target=file_chunk)
+    try:
+        network_manager.peers['peer'] = (a, ('127.0.0.1', 1))
+        network_manager._peers_changed()
+        t.start()
+        assert busy.wait(3)
+        network_manager.send_message(MessageType.TEXT, b'hi')
+        assert 'peer' in network_manager.peers
+        release.set()
+        t.join()
+        assert receive_all(b, 10) == b'TEXT\x00\x00\x00\x02hi'
+    finally:
+        release.set()
+        network_manager.peers.clear()
+        a.close()
+        b.close()
+
+
+def wait_for(predicate, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.02)
+    return False
+
+
+def test_text_delivered_between_peers():
+    host_events, guest_events = DummyCallback(), DummyCallback()
+    host = NetworkManager('127.0.0.1', 0, host_events)
+    guest = NetworkManager('127.0.0.1', 0, guest_events)
+    try:
+        assert guest.connect_to_peer('127.0.0.1', host.sock.getsockname()[1])
+        assert wait_for(lambda: len(host.peers) == 1)
+        guest.send_text('привет')
+        assert wait_for(lambda: ('message', f'{guest.nickname}: привет') in host_events.events)
+    finally:
+        guest.stop()
+        host.stop()
+
+
+
+def test_oversized_nick_is_clipped_and_node_keeps_accepting():
+    host = NetworkManager('127.0.0.1', 0, DummyCallback())
+    guest = NetworkManager('127.0.0.1', 0, DummyCallback())
+    late = NetworkManager('127.0.0.1', 0, DummyCallback())
+    try:
+        port = host.sock.getsockname()[1]
+        assert guest.connect_to_peer('127.0.0.1', port)
+        assert wait_for(lambda: len(host.peers) == 1)
+        guest.send_message(MessageType.NICK, b'n' * 70000)
+        assert wait_for(lambda: any(len(n) == MAX_NICK for n in host.peer_nicks.values()))
+        assert late.connect_to_peer('127.0.0.1', port)
+        assert wait_for(lambda: len(host.peers) == 2)
+    finally:
+        late.stop()
+        guest.stop()
+        host.stop()
+
+
+def test_peer_deltas_update_known_peers(network_manager):
+    network_manager._on_peer_list('p', encode_peers([('10.0.0.1', 1, 'a')]))
+    network_manager._on_peer_add('p', encode_peers([('10.0.0.2', 2, 'b')]))
+    network_manager._on_peer_remove('p', encode_peers([('10.0.0.1', 1, '')]))
+    assert network_manager.get_known_peer_list() == [{'address': '10.0.0.2:2', 'nick': 'b'}]
+
+
+
+def test_peer_state_parses_frames_across_reads():
+    a, b = socket.socketpair()
+    try:
+        state = PeerState(b, 'peer', ('127.0.0.1', 1), size=16)
+        big = b'x' * 40
+        a.sendall(b'BEAT' + (0).to_bytes(4, 'big') + b'TEXT' + (len(big)).to_bytes(4, 'big') + big[:10])
+        frames = []
+        while len(frames) < 2:
+            assert state.recv()
+            frames += [(tag, bytes(data)) for tag, data in state.frames()]
+            if len(frames) == 1:
+                a.sendall(big[10:])
+        assert frames == [(b'BEAT', b''), (b'TEXT', big)]
+    finally:
+        a.close()
+        b.close()
+
+
+def test_binary_peer_list_and_file_meta_roundtrip():
+    peers = [('10.0.0.1', 5000, 'боржоми'), ('::1', 65535, '')]
+    assert decode_peers(memoryview(encode_peers(peers))) == peers
+    assert parse_file_meta(encode_file_meta('отчёт.pdf', 1 << 40)) == ('отчёт.pdf', 1 << 40)
+    hs = memoryview(encode_handshake(b'\x00\xffid', '', 0))
+    assert parse_handshake(hs, 'User_9', 9) == (b'\x00\xffid', 'User_9', 9)
+
+
+def test_peer_state_rejects_oversized_frame():
+    a, b = socket.socketpair()
+    try:
+        state = PeerState(b, 'peer', ('127.0.0.1', 1), size=16)
+        a.sendall(b'TEXT' + (MAX_FRAME + 1).to_bytes(4, 'big'))
+        state.recv()
+        with pytest.raises(ValueError):
+            list(state.frames())
+    finally:
+        a.close()
+        b.close()
+
+
+def test_nick_change_coalesces_peer_list(network_manager, monkeypatch):
+    sent = []
+    monkeypatch.setattr(network_manager, 'send_peer_list', lambda conn=None: sent.append(conn))
+    network_manager.handle_nick_change('p', b'a')
+    network_manager.handle_nick_change('p', b'b')
+    assert network_manager._peers_dirty and not sent
+    assert wait_for(lambda: sent == [None])
+
+
+def test_peer_list_error_does_not_stop_event_loop(network_manager, monkeypatch):
+    calls = []
+
+    def boom(conn=None):
+        calls.append(conn)
+        raise RuntimeError('boom')
+
+    monkeypatch.setattr(network_manager, 'send_peer_list', boom)
+    network_manager.peer_list_interval = 0
+    network_manager._peers_dirty = True
+    assert wait_for(lambda: calls)
+    network_manager._peers_dirty = True
+    assert wait_for(lambda: len(calls) >= 2)
+
+
+def test_history_bulk_roundtrip_and_limit(network_manager):
+    lines = ['привет', '', 'x' * 100]
+    payloads = list(encode_history(lines))
+    assert len(payloads) == 1 and decode_history(memoryview(payloads[0])) == lines
+
+    network_manager._on_history('p', payloads[0])
+    assert list(network_manager.chat_history)[-3:] == lines
+    network_manager.chat_history.extend(str(i) for i in range(NetworkManager.HISTORY_LIMIT + 1))
+    assert len(network_manager.chat_history) == NetworkManager.HISTORY_LIMIT
+
+
+def test_oversized_frames_are_not_sent(network_manager):
+    payloads = list(encode_history(['y' * MAX_FRAME, 'ok']))
+    assert all(len(p) <= MAX_FRAME for p in payloads)
+    assert decode_history(payloads[-1])[-1] == 'ok'
+
+    before = len(network_manager.chat_history)
+    assert network_manager.send_text('z' * MAX_FRAME) is False
+    assert len(network_manager.chat_history) == before
+    with pytest.raises(ValueError):
+        network_manager.send_message(MessageType.TEXT, bytes(MAX_FRAME + 1))
+
+
+def test_heartbeat_skipped_after_recent_broadcast(network_manager):
+    a, b = socket.socketpair()
+    network_manager.heartbeat_interval = 5
+    try:
+        network_manager._peers_snapshot = {'p': (a, ('10.0.0.1', 1), 'a')}
+        network_manager.send_message(MessageType.TEXT, b'hi')
+        b.recv(64)
+        network_manager._send_heartbeats()
+        b.setblocking(False)
+        with pytest.raises(BlockingIOError):
+            b.recv(64)
+        network_manager.last_tx[a] = 0.0
+        network_manager._send_heartbeats()
+        b.setblocking(True)
+        assert b.recv(64) == b'BEAT\x00\x00\x00\x00'
+    finally:
+        network_manager._peers_snapshot = {}
+        a.close()
+        b.close()
+
+
+def test_handle_file_meta_picks_free_name(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    nm = NetworkManager('127.0.0.1', 0, lambda e, d: None, debug=False)
+    try:
+        (tmp_path / 'downloads').mkdir()
+        (tmp_path / 'downloads' / 'f.txt').write_bytes(b'old')
+        nm.handle_file_meta('a', encode_file_meta('../f.txt', 1))
+        a, b = socket.socketpair()
+        nm.peers['a'] = (a, ('127.0.0.1', 1))
+        nm.respond_file('a', True)
+        assert nm.current_files['a'].path == os.path.join('downloads', 'f_1.txt')
+        nm.handle_file_data('a', b'x')
+        assert (tmp_path / 'downloads' / 'f.txt').read_bytes() == b'old'
+    finally:
+        nm.stop()
+
+
+def test_declined_or_oversized_file_is_not_created(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    nm = NetworkManager('127.0.0.1', 0, lambda e, d: None, debug=False)
+    a, b = socket.socketpair()
+    try:
+        nm.peers['a'] = (a, ('127.0.0.1', 1))
+        nm.handle_file_meta('a', encode_file_meta('f.txt', 5))
+        nm.respond_file('a', False)
+        nm.handle_file_meta('a', encode_file_meta('huge.bin', 1 << 62))
+        nm.respond_file('a', True)
+        assert b.recv(64) == b'FDEC\x00\x00\x00\x00' * 2
+        assert not nm.current_files and not nm.file_offers
+        assert not os.listdir('downloads')
+    finally:
+        nm.stop()
+        b.close()
+
+
+@pytest.mark.parametrize('payload', [b'\x01\x02', b'\x10\x00\x01\x00\x00abc', b'\x00\x00\x01\x00\x02\xff\xfe'])
+def test_parse_handshake_rejects_garbage(payload):
+    with pytest.raises(ValueError):
+        parse_handshake(payload, 'User_1', 1)
+
+
+def test_truncated_handshake_closes_connection(network_manager, monkeypatch):
+    crashes = []
+    monkeypatch.setattr(threading, 'excepthook', crashes.append)
+    port = network_manager.sock.getsockname()[1]
+    with socket.create_connection(('127.0.0.1', port), timeout=3) as s:
+        s.sendall(b'CONN\x00\x00\x00\x02\x01\x02')
+        assert s.recv(64) == b''
+    assert not crashes and network_manager._peers_snapshot == {}
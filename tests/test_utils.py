@@ -1,8 +1,11 @@
 # tests/test_network.py
-import json
+import os
+import socket
+import threading
+import time
 import pytest
-from src.network import NetworkManager
-from src.utils import save_file
+from src.network import NetworkManager, encode_peers
+from src.utils import receive_all, save_file, send_all_vec, send_file_range, set_send_timeout, tune_socket
 
 
 class DummyCallback:
@@ -40,18 +43,17 @@ def test_is_connected_to_false(network_manager):
     assert network_manager.is_connected_to('localhost', 12345) is False
 
 
-def test_handle_peer_list_adds_thread(network_manager, monkeypatch):
-    test_data = json.dumps([
-        {'host': '127.0.0.1', 'port': 12345, 'nick': 'peer1'},
-        {'host': 'localhost', 'port': 54321, 'nick': 'peer2'},
-    ]).encode()
+def test_handle_peer_list_submits_connects(network_manager, monkeypatch):
+    test_data = encode_peers([
+        ('127.0.0.1', 12345, 'peer1'),
+        ('localhost', 54321, 'peer2'),
+    ])
 
-    started = []
-    monkeypatch.setattr('threading.Thread',
-                        lambda *args, **kwargs: started.append((args, kwargs)) or type('MockThread', (),
-                                                                                       {'start': lambda s: None})())
+    submitted = []
+    monkeypatch.setattr(network_manager._connect_pool, 'submit',
+                        lambda fn, *args: submitted.append(args))
     network_manager.handle_peer_list(test_data)
-    assert len(started) == 2
+    assert len(submitted) == 2
 
 
 def test_get_peer_list_structure(network_manager):
@@ -69,3 +71,76 @@ def test_save_file_duplicate(tmp_path, monkeypatch):
     assert p2.endswith('a_1.txt')
     assert open(p1, 'rb').read() == b'1'
     assert open(p2, 'rb').read() == b'2'
+
+
+
+def test_send_all_vec_roundtrip():
+    a, b = socket.socketpair()
+    try:
+        send_all_vec(a, (b'TEXT', (3).to_bytes(4, 'big'), b'', b'abc'))
+        assert receive_all(b, 11) == b'TEXT\x00\x00\x00\x03abc'
+    finally:
+        a.close()
+        b.close()
+
+
+def test_tune_socket_enables_keepalive():
+    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        tune_socket(s, options=[(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)])
+        assert s.getsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE)
+        assert s.getsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR)
+        if hasattr(socket, 'TCP_KEEPIDLE'):
+            assert s.getsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE) == 5
+    finally:
+        s.close()
+
+
+def test_set_send_timeout_keeps_socket_blocking():
+    a, b = socket.socketpair()
+    try:
+        set_send_timeout(a, 2.5)
+        assert a.gettimeout() is None
+        raw = a.getsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO, 16)
+        assert raw[:8] != bytes(8)
+    finally:
+        a.close()
+        b.close()
+
+
+@pytest.mark.skipif(not hasattr(os, 'sendfile'), reason='нужен os.sendfile')
+def test_send_file_range_fails_when_peer_stalls(tmp_path):
+    path = tmp_path / 'blob.bin'
+    path.write_bytes(bytes(8 << 20))
+    a, b = socket.socketpair()
+    try:
+        set_send_timeout(a, 0.2)
+        with open(path, 'rb') as f, pytest.raises(RuntimeError):
+            send_file_range(a, f, 0, 8 << 20)
+    finally:
+        a.close()
+        b.close()
+
+
+def test_receive_all_deadline_bounds_trickling_sender():
+    a, b = socket.socketpair()
+    stop = threading.Event()
+
+    def trickle():
+        while not stop.wait(0.05):
+            try:
+                b.send(b'x')
+            except OSError:
+                return
+
+    t = threading.Thread(target=trickle, daemon=True)
+    t.start()
+    try:
+        start = time.monotonic()
+        assert receive_all(a, 100, deadline=start + 0.3) is None
+        assert time.monotonic() - start < 1
+    finally:
+        stop.set()
+        t.join()
+        a.close()
+        b.close()